@@ -1,13 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query, Response
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
 from typing import Optional
 
 from database import get_db
+from models.url import is_expired, has_reached_max_clicks, is_accessible
 from schemas.url import URLCreate, URLResponse, URLShortResponse, URLStats, URLUpdate
 from services.url_service import (
     create_short_url,
-    get_url_by_code,
+    get_url_details,
+    get_redirect_url,
     get_url_stats,
     increment_click_count,
     verify_password,
@@ -39,30 +41,40 @@ def shorten_url(url_data: URLCreate, request: Request, db: Session = Depends(get
 
     short_url = f"{settings.BASE_URL}/{new_url.custom_alias or new_url.short_code}"
 
-    return URLShortResponse(
+    response = URLShortResponse(
         short_code=new_url.short_code,
         short_url=short_url,
         long_url=new_url.long_url,
         created_at=new_url.created_at,
         expires_at=new_url.expires_at
     )
+    # Give the connection back to the pool now instead of after the response is sent
+    db.close()
+
+    return response
 
 
 @router.get("/", response_model=list[URLResponse])
 def list_urls(
-    skip: int = Query(0, ge=0),
+    response: Response,
+    after_id: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=500),
     active_only: bool = Query(False),
     db: Session = Depends(get_db)
 ):
     """
-    List all URLs with pagination.
+    List all URLs with cursor pagination, ordered by ID.
 
-    - **skip**: Number of records to skip (default: 0)
+    - **after_id**: Return URLs after this ID (default: 0, the first page)
     - **limit**: Maximum number of records to return (default: 100, max: 500)
     - **active_only**: If true, only return active URLs
+
+    When there may be more results, the **X-Next-Cursor** response header
+    holds the after_id to request the next page with.
     """
-    urls = get_all_urls(db, skip=skip, limit=limit, active_only=active_only)
+    urls = get_all_urls(db, after_id=after_id, limit=limit, active_only=active_only)
+    if len(urls) == limit:
+        response.headers["X-Next-Cursor"] = str(urls[-1].id)
     return urls
 
 
@@ -89,7 +101,7 @@ def get_url_info(code: str, db: Session = Depends(get_db)):
 
     - **code**: The short code or custom alias
     """
-    url = get_url_by_code(db, code)
+    url = get_url_details(db, code)
     if not url:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -147,6 +159,7 @@ redirect_router = APIRouter(tags=["redirect"])
 @redirect_router.get("/{code}")
 def redirect_to_url(
     code: str,
+    request: Request,
     password: Optional[str] = Query(None),
     db: Session = Depends(get_db)
 ):
@@ -156,7 +169,9 @@ def redirect_to_url(
     - **code**: The short code or custom alias
     - **password**: Password if the URL is password-protected
     """
-    url = get_url_by_code(db, code)
+    # Set by RedirectFastPathMiddleware when it looked the code up and couldn't answer
+    lookup = getattr(request.state, "cached_redirect", None)
+    url = get_redirect_url(db, code, lookup)
 
     if not url:
         raise HTTPException(
@@ -164,18 +179,18 @@ def redirect_to_url(
             detail="Short URL not found"
         )
 
-    if not url.is_accessible():
+    if not is_accessible(url):
         if not url.is_active:
             raise HTTPException(
                 status_code=status.HTTP_410_GONE,
                 detail="This URL has been deactivated"
             )
-        if url.is_expired():
+        if is_expired(url):
             raise HTTPException(
                 status_code=status.HTTP_410_GONE,
                 detail="This URL has expired"
             )
-        if url.has_reached_max_clicks():
+        if has_reached_max_clicks(url):
             raise HTTPException(
                 status_code=status.HTTP_410_GONE,
                 detail="This URL has reached its maximum click limit"
@@ -194,5 +209,10 @@ def redirect_to_url(
             )
 
     increment_click_count(db, url)
+    long_url = url.long_url
+
+    # get_db only closes the session after the response is sent, release
+    # the connection before that so it is held for the DB work only
+    db.close()
 
-    return RedirectResponse(url=url.long_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+    return RedirectResponse(url=long_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
@@ -0,0 +1,396 @@
+"""
+Caches for short code lookups and buffered click counts.
+
+Lookups go through two tiers: a small per-process TTL cache, then Redis.
+The redirect path reads from here first so most hits never reach the database,
+clicks are counted in Redis and flushed to the database in batches, and
+successful password checks are remembered so repeat visitors skip bcrypt.
+The Redis tier is disabled when REDIS_URL is not configured.
+
+The process tier is only invalidated in the process doing the write, so other
+workers may serve a stale entry for up to LOCAL_CACHE_TTL seconds. URLs with
+max_clicks never go in it since their limit check needs the shared click count.
+"""
+
+import json
+import threading
+import uuid
+from datetime import datetime
+from typing import Optional
+
+import redis
+from cachetools import TTLCache
+
+from config import settings
+
+
+redis_client = redis.Redis.from_url(settings.REDIS_URL) if settings.REDIS_URL else None
+
+local_cache = TTLCache(maxsize=settings.LOCAL_CACHE_SIZE, ttl=settings.LOCAL_CACHE_TTL) if settings.LOCAL_CACHE_SIZE else None
+# TTLCache is not thread safe and sync endpoints run in a threadpool
+_local_lock = threading.Lock()
+
+
+def _url_key(code: str) -> str:
+    return f"urls:{code}"
+
+
+def _clicks_key(url_id: int) -> str:
+    return f"clicks:{url_id}"
+
+
+def _last_access_key(url_id: int) -> str:
+    return f"last:{url_id}"
+
+
+def _flushing_key(url_id: int) -> str:
+    return f"flushing:{url_id}"
+
+
+def _flushing_last_key(url_id: int) -> str:
+    return f"flushing_last:{url_id}"
+
+
+_FLUSH_LOCK_KEY = "flush_lock"
+# Identifies this process's hold on the flush lock
+_flush_lock_token = uuid.uuid4().hex
+# Seconds a flush may run before another process can take over, see tasks.flush_clicks
+FLUSH_LOCK_TTL = 60
+
+# Compare and delete / compare and expire, so a process never touches a lock it lost
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+_EXTEND_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def _password_key(token: str) -> str:
+    return f"pwok:{token}"
+
+
+def clicks_buffered() -> bool:
+    """
+    Check whether clicks are counted in Redis instead of the database
+
+    Returns:
+        bool: True if Redis is configured
+    """
+    return redis_client is not None
+
+
+def _local_get(code: str) -> Optional[dict]:
+    if local_cache is None:
+        return None
+    with _local_lock:
+        return local_cache.get(code)
+
+
+def _local_set(code: str, payload: dict) -> None:
+    if local_cache is None or payload.get("max_clicks") is not None:
+        return
+    with _local_lock:
+        local_cache[code] = payload
+
+
+def cache_get(code: str) -> Optional[dict]:
+    """
+    Get the cached payload for a short code or custom alias
+
+    Args:
+        code: Short code or custom alias
+
+    Returns:
+        Optional[dict]: The cached payload, or None on a miss. Callers must not modify it.
+    """
+    payload = _local_get(code)
+    if payload is not None or redis_client is None:
+        return payload
+    try:
+        raw = redis_client.get(_url_key(code))
+    except redis.RedisError:
+        return None
+    if not raw:
+        return None
+
+    payload = json.loads(raw)
+    _local_set(code, payload)
+    return payload
+
+
+def cache_set(code: str, payload: dict, ttl: int = settings.CACHE_TTL) -> None:
+    """
+    Cache the payload for a short code or custom alias
+
+    Args:
+        code: Short code or custom alias
+        payload: JSON serializable data to cache
+        ttl: Time to live in seconds in Redis
+    """
+    _local_set(code, payload)
+    if redis_client is None:
+        return
+    try:
+        redis_client.setex(_url_key(code), ttl, json.dumps(payload))
+    except redis.RedisError:
+        pass
+
+
+def cache_delete(*codes: Optional[str]) -> None:
+    """
+    Remove cached payloads, None codes are ignored
+
+    Args:
+        codes: Short codes and/or custom aliases to invalidate
+    """
+    codes = [code for code in codes if code]
+    if local_cache is not None:
+        with _local_lock:
+            for code in codes:
+                local_cache.pop(code, None)
+
+    if redis_client is None or not codes:
+        return
+    try:
+        redis_client.delete(*[_url_key(code) for code in codes])
+    except redis.RedisError:
+        pass
+
+
+def cache_clear() -> None:
+    """
+    Empty the per-process cache
+    """
+    if local_cache is not None:
+        with _local_lock:
+            local_cache.clear()
+
+
+def password_verified(token: str) -> bool:
+    """
+    Check whether a password check was recently successful
+
+    Args:
+        token: Token identifying the URL's password hash and the given password
+
+    Returns:
+        bool: True if the token is cached
+    """
+    if redis_client is None:
+        return False
+    try:
+        return bool(redis_client.exists(_password_key(token)))
+    except redis.RedisError:
+        return False
+
+
+def remember_password_verified(token: str, ttl: int = settings.PASSWORD_CACHE_TTL) -> None:
+    """
+    Cache a successful password check
+
+    Args:
+        token: Token identifying the URL's password hash and the given password
+        ttl: Time to live in seconds
+    """
+    if redis_client is None:
+        return
+    try:
+        redis_client.setex(_password_key(token), ttl, b"1")
+    except redis.RedisError:
+        pass
+
+
+def record_click(url_id: int, accessed_at: datetime) -> bool:
+    """
+    Buffer a click in Redis until the next flush
+
+    Args:
+        url_id: The database ID of the URL
+        accessed_at: When the click happened
+
+    Returns:
+        bool: True if buffered, False if the caller has to write it to the database
+    """
+    if redis_client is None:
+        return False
+    try:
+        (
+            redis_client.pipeline()
+            .incr(_clicks_key(url_id))
+            .set(_last_access_key(url_id), accessed_at.isoformat())
+            .execute()
+        )
+    except redis.RedisError:
+        return False
+    return True
+
+
+def pending_clicks(url_id: int) -> int:
+    """
+    Get the number of buffered clicks not yet flushed to the database
+
+    Clicks claimed by a flush still count until the flush has committed them.
+
+    Args:
+        url_id: The database ID of the URL
+
+    Returns:
+        int: Number of pending clicks
+    """
+    return pending_clicks_many([url_id]).get(url_id, 0)
+
+
+def pending_clicks_many(url_ids: list[int]) -> dict[int, int]:
+    """
+    Get the buffered clicks of several URLs with a single MGET
+
+    Args:
+        url_ids: Database IDs of the URLs
+
+    Returns:
+        dict[int, int]: Pending clicks per URL ID, URLs without any are left out
+    """
+    if redis_client is None or not url_ids:
+        return {}
+    keys = [key for url_id in url_ids for key in (_clicks_key(url_id), _flushing_key(url_id))]
+    try:
+        raw = redis_client.mget(keys)
+    except redis.RedisError:
+        return {}
+
+    pending = {}
+    for url_id, clicks, flushing in zip(url_ids, raw[::2], raw[1::2]):
+        count = int(clicks or 0) + int(flushing or 0)
+        if count:
+            pending[url_id] = count
+    return pending
+
+
+def acquire_flush_lock(ttl: int = FLUSH_LOCK_TTL) -> bool:
+    """
+    Take the lock that lets one process at a time flush clicks
+
+    Args:
+        ttl: Seconds after which the lock expires if never released
+
+    Returns:
+        bool: True if the lock was taken
+    """
+    if redis_client is None:
+        return False
+    try:
+        return bool(redis_client.set(_FLUSH_LOCK_KEY, _flush_lock_token, nx=True, ex=ttl))
+    except redis.RedisError:
+        return False
+
+
+def extend_flush_lock(ttl: int = FLUSH_LOCK_TTL) -> bool:
+    """
+    Restart the flush lock's TTL if this process still holds it
+
+    Args:
+        ttl: Seconds from now after which the lock expires
+
+    Returns:
+        bool: False if the lock expired and may be held by another process
+    """
+    if redis_client is None:
+        return False
+    try:
+        return bool(redis_client.eval(_EXTEND_LOCK_SCRIPT, 1, _FLUSH_LOCK_KEY, _flush_lock_token, ttl))
+    except redis.RedisError:
+        return False
+
+
+def release_flush_lock() -> None:
+    """
+    Release the flush lock if this process still holds it
+    """
+    if redis_client is None:
+        return
+    try:
+        redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, _FLUSH_LOCK_KEY, _flush_lock_token)
+    except redis.RedisError:
+        pass
+
+
+def _claimed_row(url_id: int, delta: Optional[bytes], last: Optional[bytes]) -> dict:
+    return {
+        "url_id": url_id,
+        "delta": int(delta) if delta else 0,
+        "accessed_at": datetime.fromisoformat(last.decode()) if last else None,
+    }
+
+
+def claim_pending_clicks() -> list[dict]:
+    """
+    Move all buffered clicks into flushing keys and return them
+
+    Each URL's click count and last access time are renamed in one
+    transaction, so no click is lost or taken twice. Claimed clicks stay
+    in Redis until clear_flushed_clicks, clicks left by a flush that
+    failed are returned again. Call with the flush lock held.
+
+    If Redis fails partway through, the rows claimed so far are returned
+    and the rest stay buffered for the next flush.
+
+    Returns:
+        list[dict]: One dict per URL with url_id, delta and accessed_at
+    """
+    if redis_client is None:
+        return []
+
+    rows = []
+    try:
+        for key in redis_client.scan_iter(match=_flushing_key("*"), count=1000):
+            url_id = int(key.split(b":", 1)[1])
+            rows.append(_claimed_row(url_id, *redis_client.mget(key, _flushing_last_key(url_id))))
+
+        leftover_ids = {row["url_id"] for row in rows}
+        for key in redis_client.scan_iter(match=_clicks_key("*"), count=1000):
+            url_id = int(key.split(b":", 1)[1])
+            if url_id in leftover_ids:
+                continue  # claimed on the next flush, once the leftover is written
+            # A missing last:{id} only fails its own RENAME, the rest still runs
+            *_, delta, last = (
+                redis_client.pipeline(transaction=True)
+                .rename(key, _flushing_key(url_id))
+                .rename(_last_access_key(url_id), _flushing_last_key(url_id))
+                .get(_flushing_key(url_id))
+                .get(_flushing_last_key(url_id))
+                .execute(raise_on_error=False)
+            )
+            rows.append(_claimed_row(url_id, delta, last))
+    except redis.RedisError:
+        pass
+    return [row for row in rows if row["delta"]]
+
+
+def clear_flushed_clicks(rows: list[dict]) -> bool:
+    """
+    Remove claimed clicks once the database has committed them
+
+    Args:
+        rows: Rows as returned by claim_pending_clicks
+
+    Returns:
+        bool: False if Redis failed, the clicks will then be flushed again
+    """
+    if redis_client is None or not rows:
+        return True
+    try:
+        redis_client.delete(*[
+            key
+            for row in rows
+            for key in (_flushing_key(row["url_id"]), _flushing_last_key(row["url_id"]))
+        ])
+    except redis.RedisError:
+        return False
+    return True
@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from functools import lru_cache
+from typing import Optional
 
 
 class Settings(BaseSettings):
@@ -17,11 +18,25 @@ class Settings(BaseSettings):
     #DATABASE CONFIG
     DATABASE_URL: str
     DB_ECHO: bool = False
+    DB_POOL_SIZE: Optional[int] = None  # defaults to max(20, 2 * CPU count)
+    DB_POOL_RECYCLE: int = 1800
 
     # URL Shortener Config
-    HASHIDS_SALT: str = "your-secret-salt-change-in-production"
+    # Short codes are base62 IDs padded to HASHIDS_MIN_LENGTH (name kept from Hashids),
+    # they are sequential and enumerable
+    HASHIDS_SALT: str = ""  # unused since base62 codes, kept so existing .env files still load
     HASHIDS_MIN_LENGTH: int = 6
     BASE_URL: str = "http://localhost:8000"
+    SECRET_KEY: str = "your-secret-key-change-in-production"
+    BCRYPT_ROUNDS: int = 12  # work factor for new link passwords, existing hashes keep theirs
+
+    # Cache config (the Redis tier is disabled when REDIS_URL is not set)
+    REDIS_URL: Optional[str] = None
+    CACHE_TTL: int = 300
+    LOCAL_CACHE_SIZE: int = 10_000  # 0 disables the per-process tier
+    LOCAL_CACHE_TTL: int = 60
+    PASSWORD_CACHE_TTL: int = 300
+    CLICK_FLUSH_INTERVAL: int = 5
 
 
     model_config = SettingsConfigDict(
@@ -1,26 +1,73 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import StaticPool
 from config import settings
 from sqlalchemy.orm import sessionmaker, Session
 from typing import Generator
 from models.url import Base
 
-# SQLite doesn't support pool_size and max_overflow
-# Check if we're using SQLite (for testing) or Postgres (production)
-if settings.DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(
-        settings.DATABASE_URL,
-        echo=settings.DB_ECHO,
-        connect_args={"check_same_thread": False}
-    )
-else:
-    engine = create_engine(
-        settings.DATABASE_URL,
+# Connection pool limits for Postgres, main.py sizes the endpoint threadpool from these.
+# These are per process, keep workers * (POOL_SIZE + MAX_OVERFLOW) under max_connections.
+POOL_SIZE = settings.DB_POOL_SIZE or max(20, 2 * (os.cpu_count() or 1))
+MAX_OVERFLOW = POOL_SIZE * 2
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    # WAL lets readers run alongside the writer, NORMAL sync is safe with WAL,
+    # and a 64MB page cache keeps hot rows in memory
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.close()
+
+
+def _build_engine(database_url: str) -> Engine:
+    """
+    Create the engine for the given database URL
+    SQLite (for testing) doesn't support pool_size and max_overflow,
+    Postgres (production) gets a tuned connection pool.
+
+    Args:
+        database_url: SQLAlchemy database URL
+
+    Returns:
+        Engine: The configured engine
+    """
+    url = make_url(database_url)
+
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            # Every connection to :memory: is a new empty database, share a single one
+            return create_engine(
+                url,
+                echo=settings.DB_ECHO,
+                connect_args={"check_same_thread": False},
+                poolclass=StaticPool
+            )
+
+        sqlite_engine = create_engine(
+            url,
+            echo=settings.DB_ECHO,
+            connect_args={"check_same_thread": False}
+        )
+        event.listen(sqlite_engine, "connect", _set_sqlite_pragmas)
+        return sqlite_engine
+
+    return create_engine(
+        url,
         echo=settings.DB_ECHO,
         pool_pre_ping=True,
-        pool_size=5,
-        max_overflow=10
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_use_lifo=True  # reuse the most recent connection, idle extras can time out
     )
 
+
+engine = _build_engine(settings.DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -28,6 +75,10 @@ def get_db() -> Generator[Session, None, None]:
     """
     Dependency for getting database session
     Usage: db: Session = Depends(get_db)
+
+    The session is closed after the response has been sent. Hot endpoints
+    call db.close() themselves once their DB work is done so the pool
+    connection is not held while the response is written.
     """
     db = SessionLocal()
     try:
@@ -40,4 +91,9 @@ def init_db() -> None:
     """
     Initialize database - create all tables
     """
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+
+
+if __name__ == "__main__":
+    # Run once at deploy time: python database.py
+    init_db()
@@ -1,26 +1,54 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from anyio import to_thread
 from fastapi import FastAPI
-from database import init_db
+from config import settings
+from database import init_db, POOL_SIZE, MAX_OVERFLOW
+from cache import redis_client
+from tasks.flush_clicks import flush_clicks, flush_loop
+from middleware import RedirectFastPathMiddleware
 from api.url_endpoints import router, redirect_router
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Outside development the schema is created once per deploy with
+    # `python database.py` instead of being inspected on every startup
+    if settings.ENVIRONMENT == "development":
+        init_db()
+
+    # Sync endpoints run in anyio's threadpool, make sure it never has
+    # fewer threads than the DB pool has connections
+    limiter = to_thread.current_default_thread_limiter()
+    limiter.total_tokens = max(limiter.total_tokens, POOL_SIZE + MAX_OVERFLOW)
+
+    flush_task = asyncio.create_task(flush_loop()) if redis_client is not None else None
+
+    yield
+
+    if flush_task is not None:
+        flush_task.cancel()
+        await asyncio.to_thread(flush_clicks)
+
+
 app = FastAPI(
     title="URL Shortener API",
     description="A simple and efficient URL shortening service",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 
-@app.on_event("startup")  # change in production
-def startup():
-    init_db()
+app.add_middleware(RedirectFastPathMiddleware)
 
 
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "ok"}
 
 
 # Include routers AFTER specific routes like /health
 # Order matters: redirect_router has /{code} which catches everything
 app.include_router(router)
-app.include_router(redirect_router)
\ No newline at end of file
+app.include_router(redirect_router)
@@ -0,0 +1,44 @@
+"""
+ASGI middleware that answers cached redirects before routing.
+A hit skips FastAPI's routing, dependency injection and DB session entirely.
+"""
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import RedirectResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from cache import clicks_buffered
+from services.url_service import get_cached_redirect
+
+
+# Single segment paths owned by the app itself, not short codes
+RESERVED_PATHS = {"health", "docs", "redoc", "openapi.json"}
+
+
+class RedirectFastPathMiddleware:
+    """
+    Serve GET /{code} straight from the cache when possible
+
+    Only active when clicks are buffered in Redis, since a fast path hit
+    must not touch the database. Anything it can't answer (misses,
+    password protected or inaccessible URLs) falls through to the router,
+    along with what the cache returned so the endpoint doesn't ask again.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["method"] == "GET" and clicks_buffered():
+            code = scope["path"][1:]
+            if code and "/" not in code and code not in RESERVED_PATHS:
+                # Cache lookups use the sync Redis client, keep them off the event loop
+                lookup, long_url = await run_in_threadpool(get_cached_redirect, code)
+                if long_url is not None:
+                    response = RedirectResponse(url=long_url, status_code=307)
+                    await response(scope, receive, send)
+                    return
+                # Let the endpoint reuse the lookup (request.state.cached_redirect)
+                scope.setdefault("state", {})["cached_redirect"] = lookup
+
+        await self.app(scope, receive, send)
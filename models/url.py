@@ -16,23 +16,39 @@ Data we need:
 - Updated date
 """
 
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, BigInteger
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, BigInteger, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime, timezone
+import time
 
 Base = declarative_base()
 
+# Columns read by the redirect, included in the lookup indexes
+REDIRECT_COLUMNS = ["long_url", "is_active", "expires_at", "max_clicks", "password_hash", "click_count"]
+
 
 class URL(Base):
     __tablename__ = "urls"
+    __table_args__ = (
+        # Covering indexes on Postgres: the redirect lookup is answered from the index alone
+        Index("ix_urls_short_code", "short_code", unique=True, postgresql_include=REDIRECT_COLUMNS),
+        Index("ix_urls_custom_alias", "custom_alias", unique=True, postgresql_include=REDIRECT_COLUMNS),
+        # Partial index for list_urls(active_only=True)
+        Index(
+            "ix_urls_active",
+            "id",
+            postgresql_where=text("is_active = true"),
+            sqlite_where=text("is_active = 1"),
+        ),
+    )
 
     # Primary Key
     id = Column(Integer, primary_key=True, index=True)
 
     # Core URL fields
     long_url = Column(String(2048), nullable=False)
-    short_code = Column(String(10), unique=True, nullable=False, index=True)
-    custom_alias = Column(String(50), unique=True, nullable=True, index=True)
+    short_code = Column(String(10), nullable=False)
+    custom_alias = Column(String(50), nullable=True)
 
     # Metadata
     title = Column(String(255), nullable=True)
@@ -50,7 +66,8 @@ class URL(Base):
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
     last_accessed_at = Column(DateTime, nullable=True)
-    expires_at = Column(DateTime, nullable=True)
+    # UNIX seconds (UTC) so the redirect check is a plain integer compare
+    expires_at = Column(BigInteger, nullable=True, index=True)
 
     # Optional features
     password_hash = Column(String(255), nullable=True)
@@ -59,23 +76,23 @@ class URL(Base):
     def __repr__(self):
         return f"<URL(id={self.id}, short_code='{self.short_code}', long_url='{self.long_url[:50]}...')>"
 
-    def is_expired(self):
-        """Check if the URL has expired"""
-        if self.expires_at is not None:
-            now = datetime.now(timezone.utc)
-            # Handle both timezone-aware and naive datetimes from database
-            if self.expires_at.tzinfo is None:
-                # Naive datetime - assume it's UTC
-                return now.replace(tzinfo=None) > self.expires_at
-            return now > self.expires_at
-        return False
-
-    def has_reached_max_clicks(self):
-        """Check if the URL has reached its maximum click limit"""
-        if self.max_clicks is not None:
-            return self.click_count >= self.max_clicks
-        return False
-
-    def is_accessible(self):
-        """Check if the URL can be accessed"""
-        return self.is_active and not self.is_expired() and not self.has_reached_max_clicks()
+
+# Accessibility checks are free functions so they work on both URL rows and
+# the lightweight RedirectTarget tuples used on the redirect path
+
+
+def is_expired(url) -> bool:
+    """Check if the URL has expired"""
+    return url.expires_at is not None and url.expires_at < time.time()
+
+
+def has_reached_max_clicks(url) -> bool:
+    """Check if the URL has reached its maximum click limit"""
+    if url.max_clicks is not None:
+        return url.click_count >= url.max_clicks
+    return False
+
+
+def is_accessible(url) -> bool:
+    """Check if the URL can be accessed"""
+    return url.is_active and not is_expired(url) and not has_reached_max_clicks(url)
@@ -1,6 +1,25 @@
-from pydantic import BaseModel, HttpUrl, Field, ConfigDict
-from datetime import datetime
-from typing import Optional
+from pydantic import BaseModel, HttpUrl, Field, ConfigDict, BeforeValidator
+from datetime import datetime, timezone
+from typing import Annotated, Optional
+
+
+def datetime_to_epoch(value: Optional[datetime]) -> Optional[int]:
+    """Convert a datetime to UNIX seconds, naive datetimes are taken as UTC"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def _epoch_to_datetime(value):
+    if isinstance(value, int):
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    return value
+
+
+# Datetime stored as UNIX seconds in the database (see URL.expires_at)
+EpochDatetime = Annotated[datetime, BeforeValidator(_epoch_to_datetime)]
 
 
 class URLCreate(BaseModel):
@@ -25,7 +44,7 @@ class URLResponse(BaseModel):
     is_active: bool
     click_count: int
     created_at: datetime
-    expires_at: Optional[datetime]
+    expires_at: Optional[EpochDatetime]
     max_clicks: Optional[int]
 
     model_config = ConfigDict(from_attributes=True)
@@ -37,7 +56,7 @@ class URLShortResponse(BaseModel):
     short_url: str
     long_url: str
     created_at: datetime
-    expires_at: Optional[datetime]
+    expires_at: Optional[EpochDatetime]
 
 
 class URLStats(BaseModel):
@@ -49,7 +68,7 @@ class URLStats(BaseModel):
     is_active: bool
     created_at: datetime
     last_accessed_at: Optional[datetime]
-    expires_at: Optional[datetime]
+    expires_at: Optional[EpochDatetime]
     is_expired: bool
     has_reached_max_clicks: bool
     is_accessible: bool
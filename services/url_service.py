@@ -1,51 +1,73 @@
+from sqlalchemy import select, text, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from hashids import Hashids
 import bcrypt
+import hashlib
+import hmac
 from fastapi import HTTPException, status
-from typing import Optional
+from typing import NamedTuple, Optional
 from datetime import datetime, timezone
 
-from models.url import URL
-from schemas.url import URLCreate, URLUpdate, URLStats
+from models.url import URL, REDIRECT_COLUMNS, is_expired, has_reached_max_clicks, is_accessible
+from schemas.url import URLCreate, URLUpdate, URLStats, datetime_to_epoch
 from config import settings
+from cache import (
+    cache_get,
+    cache_set,
+    cache_delete,
+    clicks_buffered,
+    record_click,
+    pending_clicks,
+    pending_clicks_many,
+    password_verified,
+    remember_password_verified,
+)
 
 
-# Initialize Hashids
-hashids = Hashids(
-    salt=settings.HASHIDS_SALT,
-    min_length=settings.HASHIDS_MIN_LENGTH,
-    alphabet="abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
-)
+# Base62 alphabet. Codes of consecutive IDs differ in their last digit,
+# so codes are enumerable: anyone who sees two can walk every link.
+# Never change it once codes exist, a new alphabet could reissue old codes.
+ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
 
 
-def generate_short_code(url_id: int) -> str:
-    """
-    Generate a short code from URL ID using hashids
+class RedirectTarget(NamedTuple):
+    """The columns needed to serve a redirect, this is also what gets cached per code"""
+    id: int
+    long_url: str
+    is_active: bool
+    expires_at: Optional[int]
+    max_clicks: Optional[int]
+    password_hash: Optional[str]
+    click_count: int
 
-    Args:
-        url_id: The database ID of the URL
 
-    Returns:
-        str: The generated short code
-    """
-    return hashids.encode(url_id)
+class CachedLookup(NamedTuple):
+    """What the redirect fast path found in the cache, handed on to the endpoint"""
+    code: str
+    target: Optional[RedirectTarget]  # None on a cache miss, pending clicks already included
+
 
+# Columns selected for a RedirectTarget, in field order
+_redirect_columns = [URL.id, *(getattr(URL, column) for column in REDIRECT_COLUMNS)]
 
-def decode_short_code(short_code: str) -> Optional[int]:
+
+def generate_short_code(url_id: int, length: int = settings.HASHIDS_MIN_LENGTH) -> str:
     """
-    Decode a short code back to URL ID
+    Generate a short code from URL ID by base62 encoding it
 
     Args:
-        short_code: The short code to decode
+        url_id: The database ID of the URL
+        length: Minimum length, shorter codes are left padded
 
     Returns:
-        Optional[int]: The URL ID, or None if invalid
+        str: The generated short code
     """
-    try:
-        decoded = hashids.decode(short_code)
-        return decoded[0] if decoded else None
-    except Exception:
-        return None
+    digits = []
+    while url_id:
+        url_id, remainder = divmod(url_id, 62)
+        digits.append(ALPHABET[remainder])
+    # The most significant digit is never the zero digit, so left padding keeps codes unique
+    return "".join(reversed(digits)).rjust(length, ALPHABET[0])
 
 
 def hash_password(password: str) -> str:
@@ -58,13 +80,17 @@ def hash_password(password: str) -> str:
     Returns:
         str: Hashed password
     """
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)).decode('utf-8')
 
 
-def verify_password(url: URL, password: str) -> bool:
+def verify_password(url: URL | RedirectTarget, password: str) -> bool:
     """
     Verify a password against the stored hash
 
+    Successful checks are remembered in Redis so repeat visitors skip
+    bcrypt. The token is bound to the current password_hash, changing the
+    password invalidates it. Failed checks are never cached.
+
     Args:
         url: The URL object
         password: Plain text password to verify
@@ -74,7 +100,58 @@ def verify_password(url: URL, password: str) -> bool:
     """
     if not url.password_hash:
         return True
-    return bcrypt.checkpw(password.encode('utf-8'), url.password_hash.encode('utf-8'))
+
+    # Keyed so a leaked token can't be brute forced faster than bcrypt
+    token = hmac.new(
+        settings.SECRET_KEY.encode('utf-8'),
+        f"{url.password_hash}|{password}".encode('utf-8'),
+        hashlib.sha256
+    ).hexdigest()
+    if password_verified(token):
+        return True
+
+    if not bcrypt.checkpw(password.encode('utf-8'), url.password_hash.encode('utf-8')):
+        return False
+    remember_password_verified(token)
+    return True
+
+
+def _reserve_url_id(db: Session) -> Optional[int]:
+    """
+    Take the next URL ID from the sequence before inserting
+
+    Args:
+        db: Database session
+
+    Returns:
+        Optional[int]: The reserved ID, or None if the database has no sequences (SQLite)
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return None
+    return db.execute(text("SELECT nextval(pg_get_serial_sequence('urls', 'id'))")).scalar()
+
+
+def _could_be_short_code(alias: str) -> bool:
+    # Generated codes are alphanumeric and at least HASHIDS_MIN_LENGTH long
+    return len(alias) >= settings.HASHIDS_MIN_LENGTH and alias.isalnum()
+
+
+def _violated_unique_column(exc: IntegrityError) -> Optional[str]:
+    # Postgres names the index (psycopg2 also exposes it on diag),
+    # SQLite names the column as "urls.<column>"
+    constraint = getattr(getattr(exc.orig, "diag", None), "constraint_name", None)
+    message = constraint or str(exc.orig)
+    for column in ("custom_alias", "short_code"):
+        if f"ix_urls_{column}" in message or f"urls.{column}" in message:
+            return column
+    return None
+
+
+def _raise_alias_taken(alias: str) -> None:
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Custom alias '{alias}' is already taken"
+    )
 
 
 def create_short_url(db: Session, url_data: URLCreate, creator_ip: Optional[str] = None) -> URL:
@@ -92,52 +169,186 @@ def create_short_url(db: Session, url_data: URLCreate, creator_ip: Optional[str]
     Raises:
         HTTPException: If custom alias already exists
     """
-    # Check if custom alias already exists
-    if url_data.custom_alias:
-        existing = db.query(URL).filter(
-            (URL.custom_alias == url_data.custom_alias) | (URL.short_code == url_data.custom_alias)
-        ).first()
-        if existing:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Custom alias '{url_data.custom_alias}' is already taken"
-            )
+    # Alias against alias conflicts are caught by the unique index on insert,
+    # only an alias that could also be a generated short code needs a lookup
+    if url_data.custom_alias and _could_be_short_code(url_data.custom_alias):
+        if db.query(URL.id).filter(URL.short_code == url_data.custom_alias).first():
+            _raise_alias_taken(url_data.custom_alias)
 
     # Hash password if provided
     password_hash = None
     if url_data.password:
         password_hash = hash_password(url_data.password)
 
-    # Create URL without short_code first (we need the ID)
-    new_url = URL(
-        long_url=str(url_data.long_url),
-        short_code="temporary",  # Will be updated after we get the ID
-        custom_alias=url_data.custom_alias,
-        title=url_data.title,
-        description=url_data.description,
-        expires_at=url_data.expires_at,
-        max_clicks=url_data.max_clicks,
-        password_hash=password_hash,
-        creator_ip=creator_ip,
-        is_active=True,
-        click_count=0
+    # With a reserved ID the row is inserted with its final short_code,
+    # otherwise insert a placeholder first (we need the ID)
+    url_id = _reserve_url_id(db)
+    code_lengths = range(settings.HASHIDS_MIN_LENGTH, URL.short_code.type.length + 1)
+    for code_length in code_lengths:
+        new_url = URL(
+            id=url_id,
+            long_url=str(url_data.long_url),
+            short_code=generate_short_code(url_id, code_length) if url_id else "temporary",
+            custom_alias=url_data.custom_alias,
+            title=url_data.title,
+            description=url_data.description,
+            expires_at=datetime_to_epoch(url_data.expires_at),
+            max_clicks=url_data.max_clicks,
+            password_hash=password_hash,
+            creator_ip=creator_ip,
+            is_active=True,
+            click_count=0
+        )
+
+        db.add(new_url)
+        code_written = url_id is not None
+        try:
+            if url_id is None:
+                db.flush()  # Get the ID without committing
+
+                # Generate short code from ID
+                code_written = True
+                new_url.short_code = generate_short_code(new_url.id, code_length)
+
+            # The INSERT returns the ID and all other defaults are set client side,
+            # so the flushed object is complete. Detach it before commit so it
+            # isn't expired and reloaded with another SELECT.
+            db.flush()
+            db.expunge(new_url)
+            db.commit()
+            return new_url
+        except IntegrityError as exc:
+            db.rollback()
+            column = _violated_unique_column(exc)
+            if column == "custom_alias":
+                _raise_alias_taken(url_data.custom_alias)
+            # The generated code is already stored, e.g. as a code from before
+            # the switch from Hashids. Retry padded one character longer: codes
+            # padded past their natural length start with the pad digit, which
+            # unpadded codes of that length never do, so no other ID can produce it.
+            if column != "short_code" or not code_written or code_length == code_lengths[-1]:
+                raise
+
+
+def get_url_by_code(db: Session, code: str) -> Optional[URL]:
+    """
+    Get URL by short code or custom alias
+
+    Args:
+        db: Database session
+        code: Short code or custom alias
+
+    Returns:
+        Optional[URL]: The URL object if found, None otherwise
+    """
+    # Two single-column lookups instead of an OR so each one is a plain index seek.
+    # Generated short codes are the common case, so try those first.
+    return (
+        db.query(URL).filter(URL.short_code == code).first()
+        or db.query(URL).filter(URL.custom_alias == code).first()
     )
 
-    db.add(new_url)
-    db.flush()  # Get the ID without committing
 
-    # Generate short code from ID
-    new_url.short_code = generate_short_code(new_url.id)
+def _select_redirect_target(db: Session, code: str) -> Optional[RedirectTarget]:
+    # Plain column select, skips building and tracking an ORM object.
+    # Same short_code then custom_alias order as get_url_by_code.
+    for column in (URL.short_code, URL.custom_alias):
+        row = db.execute(select(*_redirect_columns).where(column == code)).first()
+        if row:
+            return RedirectTarget(*row)
+    return None
 
-    db.commit()
-    db.refresh(new_url)
 
-    return new_url
+def get_redirect_url(db: Session, code: str, lookup: Optional[CachedLookup] = None) -> Optional[RedirectTarget]:
+    """
+    Get the URL to redirect to, served from the cache when possible
 
+    For URLs with max_clicks the clicks still buffered in Redis are
+    added to click_count so the limit check sees the real count. Clicks
+    being flushed keep counting until they are committed, so a flush can
+    only make the count briefly high (one click early refused), never low.
+    The check and the click record are separate steps though, so
+    concurrent redirects can each take the last allowed click.
 
-def get_url_by_code(db: Session, code: str) -> Optional[URL]:
+    Args:
+        db: Database session
+        code: Short code or custom alias
+        lookup: The fast path middleware's cache lookup for this request, if it made one
+
+    Returns:
+        Optional[RedirectTarget]: The redirect fields if found, None otherwise
     """
-    Get URL by short code or custom alias
+    if lookup is not None and lookup.code == code:
+        # The middleware already asked the cache, don't repeat its round trips
+        if lookup.target is not None:
+            return lookup.target
+        payload = None
+    else:
+        payload = cache_get(code)
+
+    if payload is not None:
+        target = RedirectTarget(**payload)
+    else:
+        target = _select_redirect_target(db, code)
+        if not target:
+            return None
+        # Without Redis clicks go straight to the DB, so a cached click_count would go stale
+        if target.max_clicks is None or clicks_buffered():
+            cache_set(code, target._asdict())
+
+    if target.max_clicks is not None:
+        target = target._replace(click_count=target.click_count + pending_clicks(target.id))
+    return target
+
+
+def get_cached_redirect(code: str) -> tuple[CachedLookup, Optional[str]]:
+    """
+    Resolve a redirect from the cache alone and record the click
+
+    Used by the redirect fast path middleware, which never opens a DB
+    session. Anything that needs the full endpoint gets no long URL,
+    the lookup is then passed on so get_redirect_url doesn't repeat it.
+
+    Args:
+        code: Short code or custom alias
+
+    Returns:
+        tuple[CachedLookup, Optional[str]]: The cache lookup, and the long URL
+        or None if the code isn't cached, is password protected, isn't
+        accessible, or the click couldn't be buffered
+    """
+    payload = cache_get(code)
+    if payload is None:
+        return CachedLookup(code, None), None
+
+    target = RedirectTarget(**payload)
+    if target.max_clicks is not None:
+        target = target._replace(click_count=target.click_count + pending_clicks(target.id))
+    lookup = CachedLookup(code, target)
+
+    if target.password_hash or not is_accessible(target):
+        return lookup, None
+    if not record_click(target.id, datetime.now(timezone.utc)):
+        return lookup, None
+    return lookup, target.long_url
+
+
+def _add_pending_clicks(db: Session, urls: list[URL]) -> None:
+    # Include clicks not yet flushed from Redis, on detached copies so they are never written back
+    if not clicks_buffered():
+        return
+    pending = pending_clicks_many([url.id for url in urls])
+    for url in urls:
+        db.expunge(url)
+        url.click_count += pending.get(url.id, 0)
+
+
+def get_url_details(db: Session, code: str) -> Optional[URL]:
+    """
+    Get URL by short code or custom alias, for display
+
+    Unlike get_url_by_code the click count includes clicks still
+    buffered in Redis, so the object is detached and read only.
 
     Args:
         db: Database session
@@ -146,9 +357,10 @@ def get_url_by_code(db: Session, code: str) -> Optional[URL]:
     Returns:
         Optional[URL]: The URL object if found, None otherwise
     """
-    return db.query(URL).filter(
-        (URL.short_code == code) | (URL.custom_alias == code)
-    ).first()
+    url = get_url_by_code(db, code)
+    if url:
+        _add_pending_clicks(db, [url])
+    return url
 
 
 def get_url_by_id(db: Session, url_id: int) -> Optional[URL]:
@@ -165,16 +377,27 @@ def get_url_by_id(db: Session, url_id: int) -> Optional[URL]:
     return db.query(URL).filter(URL.id == url_id).first()
 
 
-def increment_click_count(db: Session, url: URL) -> None:
+def increment_click_count(db: Session, url: URL | RedirectTarget) -> None:
     """
     Increment click count and update last accessed timestamp
 
+    When Redis is available the click is only buffered there and
+    written to the database later by tasks.flush_clicks.
+
     Args:
         db: Database session
         url: The URL object to update
     """
-    url.click_count += 1
-    url.last_accessed_at = datetime.now(timezone.utc)
+    now = datetime.now(timezone.utc)
+    if record_click(url.id, now):
+        return
+
+    # UPDATE by id so this also works for redirect targets served from the cache
+    db.execute(
+        update(URL)
+        .where(URL.id == url.id)
+        .values(click_count=URL.click_count + 1, last_accessed_at=now)
+    )
     db.commit()
 
 
@@ -193,6 +416,8 @@ def get_url_stats(db: Session, code: str) -> Optional[URLStats]:
     if not url:
         return None
 
+    _add_pending_clicks(db, [url])
+
     return URLStats(
         id=url.id,
         short_code=url.short_code,
@@ -202,9 +427,9 @@ def get_url_stats(db: Session, code: str) -> Optional[URLStats]:
         created_at=url.created_at,
         last_accessed_at=url.last_accessed_at,
         expires_at=url.expires_at,
-        is_expired=url.is_expired(),
-        has_reached_max_clicks=url.has_reached_max_clicks(),
-        is_accessible=url.is_accessible()
+        is_expired=is_expired(url),
+        has_reached_max_clicks=has_reached_max_clicks(url),
+        is_accessible=is_accessible(url)
     )
 
 
@@ -226,11 +451,15 @@ def update_url(db: Session, url_id: int, url_update: URLUpdate) -> Optional[URL]
 
     # Update only provided fields
     update_data = url_update.model_dump(exclude_unset=True)
+    if "expires_at" in update_data:
+        update_data["expires_at"] = datetime_to_epoch(update_data["expires_at"])
     for field, value in update_data.items():
         setattr(url, field, value)
 
     db.commit()
     db.refresh(url)
+    cache_delete(url.short_code, url.custom_alias)
+    _add_pending_clicks(db, [url])
 
     return url
 
@@ -251,6 +480,7 @@ def delete_url(db: Session, url_id: int, soft_delete: bool = True) -> bool:
     if not url:
         return False
 
+    codes = (url.short_code, url.custom_alias)
     if soft_delete:
         url.is_active = False
         db.commit()
@@ -258,25 +488,34 @@ def delete_url(db: Session, url_id: int, soft_delete: bool = True) -> bool:
         db.delete(url)
         db.commit()
 
+    # After the commit, so a redirect racing the delete can't re-cache the old row
+    cache_delete(*codes)
+
     return True
 
 
-def get_all_urls(db: Session, skip: int = 0, limit: int = 100, active_only: bool = False) -> list[URL]:
+def get_all_urls(db: Session, after_id: int = 0, limit: int = 100, active_only: bool = False) -> list[URL]:
     """
-    Get all URLs with pagination
+    Get all URLs with keyset pagination
+
+    Seeks past after_id on the primary key instead of using OFFSET, so
+    deep pages cost the same as the first one. Click counts include clicks
+    still buffered in Redis, fetched for the whole page at once.
 
     Args:
         db: Database session
-        skip: Number of records to skip
+        after_id: Only return URLs with an ID greater than this (the last ID of the previous page)
         limit: Maximum number of records to return
         active_only: If True, only return active URLs
 
     Returns:
-        list[URL]: List of URL objects
+        list[URL]: List of URL objects ordered by ID
     """
-    query = db.query(URL)
+    query = db.query(URL).filter(URL.id > after_id)
 
     if active_only:
         query = query.filter(URL.is_active == True)
 
-    return query.offset(skip).limit(limit).all()
+    urls = query.order_by(URL.id).limit(limit).all()
+    _add_pending_clicks(db, urls)
+    return urls
@@ -0,0 +1,109 @@
+"""
+Background task that writes click counts buffered in Redis to the database.
+All pending deltas are applied with a single executemany UPDATE per flush.
+
+Claimed clicks are only removed from Redis after the UPDATE has committed,
+so a failed flush leaves them for the next one and limit checks keep
+counting them while the write is in progress.
+
+A flush holds a Redis lock that expires after FLUSH_LOCK_TTL seconds.
+If a flush stalls past that (a row lock wait, a slow pool checkout),
+another process may take over its claimed clicks, so right before
+committing the flush renews the lock and rolls back if it was lost.
+Only the COMMIT itself runs unfenced, with a fresh FLUSH_LOCK_TTL to
+finish in.
+"""
+
+import asyncio
+import logging
+
+from sqlalchemy import bindparam, func, select, update
+
+from cache import (
+    acquire_flush_lock,
+    cache_delete,
+    claim_pending_clicks,
+    clear_flushed_clicks,
+    extend_flush_lock,
+    release_flush_lock,
+)
+from config import settings
+from database import SessionLocal
+from models.url import URL
+
+
+logger = logging.getLogger(__name__)
+
+urls = URL.__table__
+
+flush_statement = (
+    update(urls)
+    .where(urls.c.id == bindparam("url_id"))
+    .values(
+        click_count=urls.c.click_count + bindparam("delta"),
+        # Typed so the value goes through DateTime processing like ORM writes do
+        last_accessed_at=func.coalesce(
+            bindparam("accessed_at", type_=urls.c.last_accessed_at.type), urls.c.last_accessed_at
+        ),
+    )
+)
+
+
+def flush_clicks() -> int:
+    """
+    Move all buffered clicks from Redis into the database
+
+    Returns:
+        int: Number of URLs updated, 0 if another process is flushing
+    """
+    if not acquire_flush_lock():
+        return 0
+    try:
+        rows = claim_pending_clicks()
+        if not rows:
+            return 0
+
+        # If anything here fails the claimed clicks stay in Redis and are retried
+        with SessionLocal() as db:
+            limited = db.execute(
+                select(URL.short_code, URL.custom_alias).where(
+                    URL.id.in_([row["url_id"] for row in rows]),
+                    URL.max_clicks.isnot(None)
+                )
+            ).all()
+            db.connection().execute(flush_statement, rows)
+
+            if not extend_flush_lock():
+                db.rollback()
+                logger.warning("Flush lock expired before commit, leaving the clicks to the next flush")
+                return 0
+            db.commit()
+
+        # Cached click counts of limited URLs are now stale. Invalidate before
+        # clearing the claimed clicks so a limit check can briefly count a click
+        # twice but never miss one, and again after for entries cached from a
+        # read that started before the commit.
+        codes = [code for pair in limited for code in pair]
+        cache_delete(*codes)
+        if not clear_flushed_clicks(rows):
+            logger.error("Flushed clicks could not be cleared from Redis and will be counted again")
+        cache_delete(*codes)
+
+        return len(rows)
+    finally:
+        release_flush_lock()
+
+
+async def flush_loop(interval: int = settings.CLICK_FLUSH_INTERVAL) -> None:
+    """
+    Flush clicks every interval seconds until cancelled
+
+    Args:
+        interval: Seconds between flushes
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(flush_clicks)
+        except Exception:
+            logger.exception("Failed to flush click counts")
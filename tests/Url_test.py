@@ -1,67 +1,14 @@
-import os
-# Set fake environment variables BEFORE importing app
-# This prevents Settings validation error
-os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
-os.environ.setdefault("HASHIDS_SALT", "test-salt-for-testing")
-
 import pytest
-from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+import redis
 from datetime import datetime, timezone, timedelta
+from sqlalchemy import event, func, select, text
+from sqlalchemy.exc import IntegrityError
 
-from models.url import Base
-from database import get_db
-from main import app
-
-
-# ============ TEST DATABASE SETUP ============
-# This creates a fake SQLite database in memory (RAM)
-# It's completely separate from your production Postgres
-
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
-
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},  # Needed for SQLite
-    poolclass=StaticPool,  # Keeps the same connection for all tests
-)
-
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-
-def override_get_db():
-    """
-    This replaces the real database with our test database.
-    Every test gets a fresh database session.
-    """
-    db = TestingSessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-# Tell FastAPI to use our test database instead of production
-app.dependency_overrides[get_db] = override_get_db
-
-
-@pytest.fixture(autouse=True)
-def setup_database():
-    """
-    This runs before EACH test:
-    1. Creates all tables
-    2. Runs the test
-    3. Drops all tables (clean slate for next test)
-    """
-    Base.metadata.create_all(bind=engine)
-    yield
-    Base.metadata.drop_all(bind=engine)
-
-
-# Create test client
-client = TestClient(app)
+import cache
+from api import url_endpoints
+from models.url import URL
+from services import url_service
+from tasks import flush_clicks as flush_clicks_task
 
 
 # ============ TESTS FOR POST /api/urls/shorten ============
@@ -69,51 +16,96 @@ client = TestClient(app)
 class TestShortenEndpoint:
     """Tests for creating shortened URLs"""
 
-    def test_shorten_url_basic(self):
-        """Test creating a simple shortened URL"""
-        response = client.post(
+    @pytest.mark.parametrize("body,expected,checker", [
+        pytest.param(
+            {"long_url": "https://www.google.com"},
+            201,
+            lambda data: "short_code" in data and "short_url" in data
+            and data["long_url"] == "https://www.google.com/",
+            id="basic",
+        ),
+        pytest.param(
+            {"long_url": "https://www.github.com", "custom_alias": "my-github"},
+            201,
+            lambda data: "my-github" in data["short_url"],
+            id="custom_alias",
+        ),
+        # Rejected by validation before the handler runs, no database needed
+        pytest.param({"long_url": "not-a-valid-url"}, 422, None, id="invalid_url", marks=pytest.mark.nodb),
+        pytest.param(
+            {"long_url": "https://www.google.com", "custom_alias": "has spaces!"},  # Invalid characters
+            422,
+            None,
+            id="invalid_alias",
+            marks=pytest.mark.nodb,
+        ),
+    ])
+    def test_shorten_url_variants(self, client, db, body, expected, checker):
+        """Test creating URLs from different request bodies"""
+        response = client.post("/api/urls/shorten", json=body)
+
+        assert response.status_code == expected
+        if checker:
+            assert checker(response.json())
+
+    def test_shorten_url_duplicate_alias_fails(self, client, db):
+        """Test that duplicate custom alias returns error"""
+        # Create first URL
+        client.post(
             "/api/urls/shorten",
-            json={"long_url": "https://www.google.com"}
+            json={"long_url": "https://www.google.com", "custom_alias": "test123"}
         )
 
-        assert response.status_code == 201
-        data = response.json()
-        assert "short_code" in data
-        assert "short_url" in data
-        assert data["long_url"] == "https://www.google.com/"
-
-    def test_shorten_url_with_custom_alias(self):
-        """Test creating URL with custom alias"""
+        # Try to create second URL with same alias
         response = client.post(
             "/api/urls/shorten",
-            json={
-                "long_url": "https://www.github.com",
-                "custom_alias": "my-github"
-            }
+            json={"long_url": "https://www.github.com", "custom_alias": "test123"}
         )
 
+        assert response.status_code == 400
+        assert "already taken" in response.json()["detail"]
+
+    def test_shorten_url_other_conflict_is_not_reported_as_alias(self, client, db):
+        """Test a short_code conflict isn't mistaken for a taken alias"""
+        # Another create still holding the SQLite placeholder code
+        db.add(URL(long_url="https://www.google.com/", short_code="temporary", is_active=True, click_count=0))
+        db.commit()
+
+        with pytest.raises(IntegrityError):
+            client.post("/api/urls/shorten", json={"long_url": "https://www.github.com", "custom_alias": "free-alias"})
+
+    @pytest.mark.parametrize("alias", [None, "my-alias"], ids=["generated", "custom_alias"])
+    def test_shorten_url_generated_code_conflict_is_retried(self, client, db, alias):
+        """Test a generated code already stored by an older row is skipped"""
+        # An older (e.g. Hashids) code equal to what the next ID encodes to,
+        # the older row takes one ID itself
+        next_id = (db.scalar(select(func.max(URL.id))) or 0) + 2
+        taken = url_service.generate_short_code(next_id)
+        db.add(URL(long_url="https://www.google.com/", short_code=taken, is_active=True, click_count=0))
+        db.commit()
+
+        response = client.post("/api/urls/shorten", json={"long_url": "https://www.github.com", "custom_alias": alias})
+
         assert response.status_code == 201
-        data = response.json()
-        assert "my-github" in data["short_url"]
+        assert db.scalar(select(URL.short_code).where(URL.id == next_id)) == url_service.ALPHABET[0] + taken
 
-    def test_shorten_url_duplicate_alias_fails(self):
-        """Test that duplicate custom alias returns error"""
-        # Create first URL
-        client.post(
+    def test_shorten_url_alias_matching_short_code_fails(self, client, db):
+        """Test that a custom alias can't shadow an existing short code"""
+        first = client.post(
             "/api/urls/shorten",
-            json={"long_url": "https://www.google.com", "custom_alias": "test123"}
+            json={"long_url": "https://www.google.com"}
         )
+        short_code = first.json()["short_code"]
 
-        # Try to create second URL with same alias
         response = client.post(
             "/api/urls/shorten",
-            json={"long_url": "https://www.github.com", "custom_alias": "test123"}
+            json={"long_url": "https://www.github.com", "custom_alias": short_code}
         )
 
         assert response.status_code == 400
         assert "already taken" in response.json()["detail"]
 
-    def test_shorten_url_with_all_options(self):
+    def test_shorten_url_with_all_options(self, client, db, frozen_now):
         """Test creating URL with all optional fields"""
         future_date = (datetime.now(timezone.utc) + timedelta(days=7)).isoformat()
 
@@ -131,27 +123,7 @@ class TestShortenEndpoint:
         )
 
         assert response.status_code == 201
-
-    def test_shorten_url_invalid_url_fails(self):
-        """Test that invalid URL returns validation error"""
-        response = client.post(
-            "/api/urls/shorten",
-            json={"long_url": "not-a-valid-url"}
-        )
-
-        assert response.status_code == 422  # Validation error
-
-    def test_shorten_url_invalid_alias_fails(self):
-        """Test that invalid custom alias format returns error"""
-        response = client.post(
-            "/api/urls/shorten",
-            json={
-                "long_url": "https://www.google.com",
-                "custom_alias": "has spaces!"  # Invalid characters
-            }
-        )
-
-        assert response.status_code == 422
+        assert datetime.fromisoformat(response.json()["expires_at"]) == datetime.fromisoformat(future_date)
 
 
 # ============ TESTS FOR GET ENDPOINTS ============
@@ -159,40 +131,24 @@ class TestShortenEndpoint:
 class TestGetEndpoints:
     """Tests for retrieving URL information"""
 
-    def test_get_url_info(self):
+    def test_get_url_info(self, client, db, readonly_url):
         """Test getting URL info by code"""
-        # First create a URL
-        create_response = client.post(
-            "/api/urls/shorten",
-            json={"long_url": "https://www.google.com"}
-        )
-        short_code = create_response.json()["short_code"]
-
-        # Then get its info
-        response = client.get(f"/api/urls/{short_code}")
+        response = client.get(f"/api/urls/{readonly_url}")
 
         assert response.status_code == 200
         data = response.json()
-        assert data["short_code"] == short_code
+        assert data["short_code"] == readonly_url
         assert data["click_count"] == 0
 
-    def test_get_url_info_not_found(self):
+    def test_get_url_info_not_found(self, client, db):
         """Test getting non-existent URL returns 404"""
         response = client.get("/api/urls/nonexistent123")
 
         assert response.status_code == 404
 
-    def test_get_url_stats(self):
+    def test_get_url_stats(self, client, db, readonly_url):
         """Test getting URL statistics"""
-        # Create a URL
-        create_response = client.post(
-            "/api/urls/shorten",
-            json={"long_url": "https://www.google.com"}
-        )
-        short_code = create_response.json()["short_code"]
-
-        # Get stats
-        response = client.get(f"/api/urls/{short_code}/stats")
+        response = client.get(f"/api/urls/{readonly_url}/stats")
 
         assert response.status_code == 200
         data = response.json()
@@ -200,47 +156,49 @@ class TestGetEndpoints:
         assert "is_accessible" in data
         assert data["is_expired"] is False
 
-    def test_list_urls(self):
-        """Test listing all URLs"""
-        # Create a few URLs
-        client.post("/api/urls/shorten", json={"long_url": "https://www.google.com"})
-        client.post("/api/urls/shorten", json={"long_url": "https://www.github.com"})
 
-        # List them
+class TestListEndpoints:
+    """Tests for listing URLs, kept apart from readonly_url so the counts are exact"""
+
+    def test_list_urls(self, client, five_urls):
+        """Test listing all URLs"""
         response = client.get("/api/urls/")
 
         assert response.status_code == 200
         data = response.json()
-        assert len(data) == 2
+        assert len(data) == 5
 
-    def test_list_urls_pagination(self):
+    def test_list_urls_pagination(self, client, five_urls):
         """Test pagination works"""
-        # Create 5 URLs
-        for i in range(5):
-            client.post("/api/urls/shorten", json={"long_url": f"https://www.example{i}.com"})
-
         # Get only 2
-        response = client.get("/api/urls/?skip=0&limit=2")
+        response = client.get("/api/urls/?limit=2")
 
         assert response.status_code == 200
         assert len(response.json()) == 2
 
+        # Follow the cursor to the next page
+        cursor = response.headers["X-Next-Cursor"]
+        assert cursor == str(response.json()[-1]["id"])
+        next_page = client.get(f"/api/urls/?after_id={cursor}&limit=2").json()
+        assert len(next_page) == 2
+        assert next_page[0]["id"] > int(cursor)
+
+    def test_list_urls_last_page_has_no_cursor(self, client, url_row):
+        """Test that a page with fewer results than the limit ends pagination"""
+        response = client.get("/api/urls/?limit=2")
+
+        assert len(response.json()) == 1
+        assert "X-Next-Cursor" not in response.headers
+
 
 # ============ TESTS FOR UPDATE/DELETE ============
 
 class TestUpdateDelete:
     """Tests for updating and deleting URLs"""
 
-    def test_update_url(self):
+    def test_update_url(self, client, url_row):
         """Test updating URL properties"""
-        # Create URL
-        create_response = client.post(
-            "/api/urls/shorten",
-            json={"long_url": "https://www.google.com"}
-        )
-        url_id = client.get(
-            f"/api/urls/{create_response.json()['short_code']}"
-        ).json()["id"]
+        url_id = url_row.id
 
         # Update it
         response = client.patch(
@@ -251,7 +209,7 @@ class TestUpdateDelete:
         assert response.status_code == 200
         assert response.json()["title"] == "New Title"
 
-    def test_update_url_not_found(self):
+    def test_update_url_not_found(self, client, db):
         """Test updating non-existent URL"""
         response = client.patch(
             "/api/urls/99999",
@@ -260,15 +218,10 @@ class TestUpdateDelete:
 
         assert response.status_code == 404
 
-    def test_soft_delete_url(self):
+    def test_soft_delete_url(self, client, url_row):
         """Test soft deleting a URL (default)"""
-        # Create URL
-        create_response = client.post(
-            "/api/urls/shorten",
-            json={"long_url": "https://www.google.com"}
-        )
-        short_code = create_response.json()["short_code"]
-        url_id = client.get(f"/api/urls/{short_code}").json()["id"]
+        short_code = url_row.short_code
+        url_id = url_row.id
 
         # Soft delete
         response = client.delete(f"/api/urls/{url_id}")
@@ -279,15 +232,10 @@ class TestUpdateDelete:
         assert info.status_code == 200
         assert info.json()["is_active"] is False
 
-    def test_hard_delete_url(self):
+    def test_hard_delete_url(self, client, url_row):
         """Test permanently deleting a URL"""
-        # Create URL
-        create_response = client.post(
-            "/api/urls/shorten",
-            json={"long_url": "https://www.google.com"}
-        )
-        short_code = create_response.json()["short_code"]
-        url_id = client.get(f"/api/urls/{short_code}").json()["id"]
+        short_code = url_row.short_code
+        url_id = url_row.id
 
         # Hard delete
         response = client.delete(f"/api/urls/{url_id}?hard_delete=true")
@@ -303,29 +251,17 @@ class TestUpdateDelete:
 class TestRedirect:
     """Tests for the redirect endpoint"""
 
-    def test_redirect_works(self):
+    def test_redirect_works(self, client, db, readonly_url):
         """Test basic redirect"""
-        # Create URL
-        create_response = client.post(
-            "/api/urls/shorten",
-            json={"long_url": "https://www.google.com"}
-        )
-        short_code = create_response.json()["short_code"]
-
         # Follow redirect (allow_redirects=False to check the redirect response)
-        response = client.get(f"/{short_code}", follow_redirects=False)
+        response = client.get(f"/{readonly_url}", follow_redirects=False)
 
         assert response.status_code == 307
         assert "google.com" in response.headers["location"]
 
-    def test_redirect_increments_click_count(self):
+    def test_redirect_increments_click_count(self, client, created_url):
         """Test that redirect increments click count"""
-        # Create URL
-        create_response = client.post(
-            "/api/urls/shorten",
-            json={"long_url": "https://www.google.com"}
-        )
-        short_code = create_response.json()["short_code"]
+        short_code = created_url["short_code"]
 
         # Click it twice
         client.get(f"/{short_code}", follow_redirects=False)
@@ -335,20 +271,15 @@ class TestRedirect:
         stats = client.get(f"/api/urls/{short_code}/stats").json()
         assert stats["click_count"] == 2
 
-    def test_redirect_not_found(self):
+    def test_redirect_not_found(self, client, db):
         """Test redirect for non-existent code"""
         response = client.get("/nonexistent123", follow_redirects=False)
         assert response.status_code == 404
 
-    def test_redirect_inactive_url_fails(self):
+    def test_redirect_inactive_url_fails(self, client, created_url):
         """Test that inactive URLs return 410 Gone"""
-        # Create and deactivate URL
-        create_response = client.post(
-            "/api/urls/shorten",
-            json={"long_url": "https://www.google.com"}
-        )
-        short_code = create_response.json()["short_code"]
-        url_id = client.get(f"/api/urls/{short_code}").json()["id"]
+        short_code = created_url["short_code"]
+        url_id = created_url["id"]
 
         # Deactivate
         client.patch(f"/api/urls/{url_id}", json={"is_active": False})
@@ -357,59 +288,58 @@ class TestRedirect:
         response = client.get(f"/{short_code}", follow_redirects=False)
         assert response.status_code == 410
 
-    def test_redirect_with_custom_alias(self):
-        """Test redirect works with custom alias"""
+    def test_redirect_after_deactivation_fails(self, client, created_url):
+        """Test that deactivating a URL invalidates its cached redirect"""
+        short_code = created_url["short_code"]
+        url_id = created_url["id"]
+
+        # First redirect caches the URL
+        assert client.get(f"/{short_code}", follow_redirects=False).status_code == 307
+
+        client.patch(f"/api/urls/{url_id}", json={"is_active": False})
+
+        response = client.get(f"/{short_code}", follow_redirects=False)
+        assert response.status_code == 410
+
+    def test_redirect_expired_url_fails(self, client, db, frozen_now):
+        """Test that URLs return 410 Gone once they expire"""
+        expires_at = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
         create_response = client.post(
             "/api/urls/shorten",
-            json={"long_url": "https://www.github.com", "custom_alias": "github"}  # min 3 chars
+            json={"long_url": "https://www.google.com", "expires_at": expires_at}
         )
-        assert create_response.status_code == 201  # Verify URL was created
+        short_code = create_response.json()["short_code"]
 
-        response = client.get("/github", follow_redirects=False)
-        assert response.status_code == 307
-        assert "github.com" in response.headers["location"]
+        assert client.get(f"/{short_code}", follow_redirects=False).status_code == 307
 
-    def test_redirect_password_protected_without_password(self):
-        """Test password protected URL requires password"""
-        client.post(
-            "/api/urls/shorten",
-            json={
-                "long_url": "https://www.secret.com",
-                "custom_alias": "secret",
-                "password": "mypassword"
-            }
-        )
+        # Jump past the expiration instead of waiting for it
+        frozen_now.move_to(datetime.now(timezone.utc) + timedelta(days=2))
 
-        response = client.get("/secret", follow_redirects=False)
-        assert response.status_code == 401
+        response = client.get(f"/{short_code}", follow_redirects=False)
+        assert response.status_code == 410
+        assert "expired" in response.json()["detail"]
 
-    def test_redirect_password_protected_with_correct_password(self):
-        """Test password protected URL works with correct password"""
-        client.post(
+    def test_redirect_with_custom_alias(self, client, db):
+        """Test redirect works with custom alias"""
+        create_response = client.post(
             "/api/urls/shorten",
-            json={
-                "long_url": "https://www.secret.com",
-                "custom_alias": "secret2",
-                "password": "mypassword"
-            }
+            json={"long_url": "https://www.github.com", "custom_alias": "github"}  # min 3 chars
         )
+        assert create_response.status_code == 201  # Verify URL was created
 
-        response = client.get("/secret2?password=mypassword", follow_redirects=False)
+        response = client.get("/github", follow_redirects=False)
         assert response.status_code == 307
+        assert "github.com" in response.headers["location"]
 
-    def test_redirect_password_protected_with_wrong_password(self):
-        """Test password protected URL rejects wrong password"""
-        client.post(
-            "/api/urls/shorten",
-            json={
-                "long_url": "https://www.secret.com",
-                "custom_alias": "secret3",
-                "password": "mypassword"
-            }
-        )
-
-        response = client.get("/secret3?password=wrongpassword", follow_redirects=False)
-        assert response.status_code == 401
+    @pytest.mark.parametrize("query, expected", [
+        ("", 401),
+        ("?password=mypassword", 307),
+        ("?password=wrongpassword", 401),
+    ], ids=["without_password", "correct_password", "wrong_password"])
+    def test_redirect_password_protected(self, client, db, pw_url, query, expected):
+        """Test password protected URLs only redirect with the right password"""
+        response = client.get(f"/{pw_url}{query}", follow_redirects=False)
+        assert response.status_code == expected
 
 
 # ============ TESTS FOR EDGE CASES ============
@@ -417,7 +347,7 @@ class TestRedirect:
 class TestEdgeCases:
     """Tests for edge cases and special scenarios"""
 
-    def test_max_clicks_limit(self):
+    def test_max_clicks_limit(self, client, db):
         """Test URL becomes inaccessible after max clicks"""
         # Create URL with max 2 clicks
         create_response = client.post(
@@ -435,8 +365,259 @@ class TestEdgeCases:
         assert response.status_code == 410
         assert "maximum click limit" in response.json()["detail"]
 
-    def test_health_check(self):
+    @pytest.mark.nodb
+    def test_health_check(self, client):
         """Test health endpoint still works"""
         response = client.get("/health")
         assert response.status_code == 200
         assert response.json() == {"status": "ok"}
+
+
+# ============ TESTS WITH REDIS ============
+
+def _db_click_count(db, url_id):
+    # Column select, so it reads what's committed rather than the session's identity map
+    return db.scalar(select(URL.click_count).where(URL.id == url_id))
+
+
+def _add_url(db, **fields):
+    url = URL(long_url="https://www.google.com/", is_active=True, click_count=0, **fields)
+    db.add(url)
+    db.commit()
+    return url.id
+
+
+class TestClickBuffering:
+    """Tests for clicks buffered in Redis and flushed to the database"""
+
+    def test_clicks_are_buffered_until_flush(self, client, db, flush):
+        """Test redirects only count in Redis until a flush writes them"""
+        url_id = _add_url(db, short_code="abc123")
+
+        client.get("/abc123", follow_redirects=False)
+        client.get("/abc123", follow_redirects=False)
+
+        assert _db_click_count(db, url_id) == 0
+        assert cache.pending_clicks(url_id) == 2
+        assert client.get("/api/urls/abc123/stats").json()["click_count"] == 2
+
+        assert flush() == 1
+        assert _db_click_count(db, url_id) == 2
+        assert cache.pending_clicks(url_id) == 0
+        # Stored the way ORM writes store it, without the driver's default adapter's UTC offset
+        stored = db.scalar(text("SELECT last_accessed_at FROM urls WHERE id = :id"), {"id": url_id})
+        assert stored is not None and "+" not in stored
+
+    def test_endpoints_agree_on_buffered_click_count(self, client, db, fake_redis):
+        """Test info, stats, list and update all include clicks not yet flushed"""
+        url_id = _add_url(db, short_code="abc123")
+        _add_url(db, short_code="def456")
+        for _ in range(3):
+            client.get("/abc123", follow_redirects=False)
+
+        assert client.get("/api/urls/abc123").json()["click_count"] == 3
+        assert client.get("/api/urls/abc123/stats").json()["click_count"] == 3
+        listed = {url["id"]: url["click_count"] for url in client.get("/api/urls/").json()}
+        assert listed[url_id] == 3
+        assert sorted(listed.values()) == [0, 3]
+        assert client.patch(f"/api/urls/{url_id}", json={"title": "Google"}).json()["click_count"] == 3
+        assert _db_click_count(db, url_id) == 0
+
+    def test_max_clicks_counts_pending_clicks(self, client, db, flush):
+        """Test the click limit is enforced before and after a flush"""
+        _add_url(db, short_code="lim123", max_clicks=2)
+
+        assert client.get("/lim123", follow_redirects=False).status_code == 307
+        assert client.get("/lim123", follow_redirects=False).status_code == 307
+        assert client.get("/lim123", follow_redirects=False).status_code == 410
+
+        flush()
+        assert client.get("/lim123", follow_redirects=False).status_code == 410
+
+    def test_claimed_clicks_count_until_cleared(self, client, db, fake_redis):
+        """Test clicks being flushed still count towards max_clicks until committed"""
+        url_id = _add_url(db, short_code="lim123", max_clicks=1)
+        client.get("/lim123", follow_redirects=False)
+
+        rows = cache.claim_pending_clicks()
+        assert cache.pending_clicks(url_id) == 1
+        assert client.get("/lim123", follow_redirects=False).status_code == 410
+
+        cache.clear_flushed_clicks(rows)
+        assert cache.pending_clicks(url_id) == 0
+
+    def test_failed_flush_keeps_clicks_without_double_counting(self, client, db, flush, monkeypatch):
+        """Test a flush that fails leaves its clicks for the next one, counted once"""
+        url_id = _add_url(db, short_code="abc123")
+        client.get("/abc123", follow_redirects=False)
+
+        def failing_select(*args, **kwargs):
+            raise RuntimeError("database unavailable")
+
+        with monkeypatch.context() as patched:
+            patched.setattr("tasks.flush_clicks.select", failing_select)
+            with pytest.raises(RuntimeError):
+                flush()
+
+        assert _db_click_count(db, url_id) == 0
+        assert cache.pending_clicks(url_id) == 1
+
+        assert flush() == 1
+        assert _db_click_count(db, url_id) == 1
+        assert db.scalar(select(URL.last_accessed_at).where(URL.id == url_id)) is not None
+        assert flush() == 0
+
+    def test_flush_that_lost_its_lock_does_not_commit(self, client, db, flush, fake_redis, monkeypatch):
+        """Test a flush that stalled past the lock TTL leaves its clicks to the new lock holder"""
+        url_id = _add_url(db, short_code="abc123")
+        client.get("/abc123", follow_redirects=False)
+
+        real_select = flush_clicks_task.select
+
+        def stalled_select(*args, **kwargs):
+            # The lock expires mid flush and another process takes it
+            fake_redis.set("flush_lock", "another-process")
+            return real_select(*args, **kwargs)
+
+        with monkeypatch.context() as patched:
+            patched.setattr(flush_clicks_task, "select", stalled_select)
+            assert flush() == 0
+
+        assert _db_click_count(db, url_id) == 0
+        assert cache.pending_clicks(url_id) == 1
+        assert fake_redis.get("flush_lock") == b"another-process"
+
+        fake_redis.delete("flush_lock")
+        assert flush() == 1
+        assert _db_click_count(db, url_id) == 1
+
+    def test_flush_lock_release_keeps_another_holders_lock(self, fake_redis):
+        """Test releasing only deletes the lock while this process holds it"""
+        assert cache.acquire_flush_lock()
+        fake_redis.set("flush_lock", "another-process")
+
+        cache.release_flush_lock()
+        assert fake_redis.get("flush_lock") == b"another-process"
+
+    def test_redis_error_while_claiming_loses_no_clicks(self, client, db, flush, fake_redis, monkeypatch):
+        """Test a Redis error partway through a flush neither loses nor repeats clicks"""
+        first_id = _add_url(db, short_code="abc123")
+        second_id = _add_url(db, short_code="def456")
+        client.get("/abc123", follow_redirects=False)
+        client.get("/def456", follow_redirects=False)
+
+        # The second per-URL claim fails
+        pipeline = fake_redis.pipeline
+        calls = []
+
+        def flaky_pipeline(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise redis.ConnectionError("connection lost")
+            return pipeline(*args, **kwargs)
+
+        with monkeypatch.context() as patched:
+            patched.setattr(fake_redis, "pipeline", flaky_pipeline)
+            assert flush() == 1
+
+        assert flush() == 1
+        assert _db_click_count(db, first_id) == 1
+        assert _db_click_count(db, second_id) == 1
+
+
+class TestRedisCache:
+    """Tests for the Redis backed lookup and password caches"""
+
+    def test_repeat_password_hit_skips_bcrypt(self, client, db, fake_redis, monkeypatch):
+        """Test a remembered password check doesn't run bcrypt again"""
+        client.post(
+            "/api/urls/shorten",
+            json={"long_url": "https://www.secret.com", "custom_alias": "secret", "password": "mypassword"}
+        )
+        assert client.get("/secret?password=mypassword", follow_redirects=False).status_code == 307
+
+        def checkpw(*args):
+            raise AssertionError("bcrypt ran for a remembered password")
+
+        monkeypatch.setattr(url_service.bcrypt, "checkpw", checkpw)
+        assert client.get("/secret?password=mypassword", follow_redirects=False).status_code == 307
+
+    def test_fast_path_answers_cached_code(self, client, db, fake_redis, monkeypatch):
+        """Test a cached redirect is served by the middleware without the endpoint"""
+        url_id = _add_url(db, short_code="abc123")
+        client.get("/abc123", follow_redirects=False)  # Caches the code
+
+        def get_redirect_url(*args):
+            raise AssertionError("the redirect endpoint ran on a cache hit")
+
+        monkeypatch.setattr(url_endpoints, "get_redirect_url", get_redirect_url)
+        response = client.get("/abc123", follow_redirects=False)
+
+        assert response.status_code == 307
+        assert response.headers["location"] == "https://www.google.com/"
+        assert cache.pending_clicks(url_id) == 2
+
+    @pytest.mark.parametrize("code, cached, expected", [
+        ("abc123", False, 307),  # First visit
+        ("nonexistent123", False, 404),
+        ("secret", True, 401),  # Cached but password protected
+    ], ids=["first_visit", "not_found", "password_protected"])
+    def test_fall_through_reuses_the_fast_path_lookup(self, client, db, fake_redis, monkeypatch, code, cached, expected):
+        """Test a request the middleware can't answer asks the cache only once"""
+        _add_url(db, short_code="abc123")
+        client.post(
+            "/api/urls/shorten",
+            json={"long_url": "https://www.secret.com", "custom_alias": "secret", "password": "mypassword"}
+        )
+        if cached:
+            client.get(f"/{code}", follow_redirects=False)
+
+        calls = []
+        real_cache_get = url_service.cache_get
+
+        def counting_cache_get(key):
+            calls.append(key)
+            return real_cache_get(key)
+
+        monkeypatch.setattr(url_service, "cache_get", counting_cache_get)
+
+        assert client.get(f"/{code}", follow_redirects=False).status_code == expected
+        assert calls == [code]
+
+    def test_fast_path_falls_through_on_miss(self, client, db, fake_redis):
+        """Test an uncached code goes on to the endpoint"""
+        _add_url(db, short_code="abc123")
+
+        assert cache.cache_get("abc123") is None
+        assert client.get("/abc123", follow_redirects=False).status_code == 307
+        assert client.get("/nonexistent123", follow_redirects=False).status_code == 404
+
+    def test_fast_path_falls_through_for_password_protected(self, client, db, fake_redis):
+        """Test a cached password protected code still asks the endpoint for the password"""
+        client.post(
+            "/api/urls/shorten",
+            json={"long_url": "https://www.secret.com", "custom_alias": "secret", "password": "mypassword"}
+        )
+        client.get("/secret", follow_redirects=False)  # Caches the code
+        assert cache.cache_get("secret") is not None
+
+        response = client.get("/secret", follow_redirects=False)
+        assert response.status_code == 401
+
+    @pytest.mark.parametrize("hard_delete", [False, True], ids=["soft", "hard"])
+    def test_delete_invalidates_entries_cached_during_commit(self, client, db, fake_redis, hard_delete):
+        """Test a redirect that re-caches the row while a delete commits can't keep it alive"""
+        url_id = _add_url(db, short_code="abc123")
+        client.get("/abc123", follow_redirects=False)  # Caches the code
+        payload = cache.cache_get("abc123")
+
+        # What a redirect missing the cache just before the commit would write back
+        @event.listens_for(db, "before_commit", once=True)
+        def _recache(session):
+            cache.cache_set("abc123", payload)
+
+        response = client.delete(f"/api/urls/{url_id}", params={"hard_delete": hard_delete})
+        assert response.status_code == 204
+
+        assert cache.cache_get("abc123") is None
+        assert client.get("/abc123", follow_redirects=False).status_code in (404, 410)
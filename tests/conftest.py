@@ -0,0 +1,242 @@
+import os
+# Set fake environment variables BEFORE importing app
+# This prevents Settings validation error
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+# Minimum bcrypt cost, hashing isn't what the tests are measuring
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+import fakeredis
+import pytest
+import time_machine
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import cache
+from models.url import Base, URL
+from database import get_db
+from cache import cache_clear
+from main import app
+from tasks import flush_clicks as flush_clicks_task
+
+
+# ============ TEST DATABASE SETUP ============
+# This creates a fake SQLite database in memory (RAM)
+# It's completely separate from your production Postgres
+# Shared by every test module through the fixtures below
+# Under pytest-xdist (pytest -n auto) every worker is its own process,
+# so each one gets a separate in-memory database and URL cache
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False)
+
+
+@pytest.fixture(scope="session")
+def engine():
+    """
+    One in-memory database for the whole test session
+    """
+    test_engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False},  # Needed for SQLite
+        poolclass=StaticPool,  # Keeps the same connection for all tests
+    )
+
+    # pysqlite's own transaction handling breaks SAVEPOINTs, so let
+    # SQLAlchemy emit BEGIN itself (see the SQLAlchemy SQLite dialect docs)
+    @event.listens_for(test_engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    # The test database is thrown away, skip journaling and syncing on commit
+    @event.listens_for(test_engine, "connect")
+    def _fast_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=MEMORY")
+        cursor.execute("PRAGMA synchronous=OFF")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    @event.listens_for(test_engine, "begin")
+    def _emit_begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+    yield test_engine
+    test_engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def _schema(engine):
+    """
+    Creates all tables once for the whole test session
+    """
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope="class")
+def _class_connection(engine, _schema):
+    """
+    One outer transaction per test class
+    Class-scoped data (readonly_url) lives in it and each test
+    nests a SAVEPOINT on top, so it's all rolled back when the class is done
+    """
+    connection = engine.connect()
+    transaction = connection.begin()
+
+    yield connection
+
+    transaction.rollback()
+    connection.close()
+
+
+@pytest.fixture
+def db(request):
+    """
+    Opt-in for tests that touch the database, around each of them:
+    1. Opens a SAVEPOINT and empties the URL cache
+    2. Runs the test with a session inside that SAVEPOINT,
+       commits made by the app only release a nested one
+    3. Rolls the SAVEPOINT back (clean slate for next test)
+    Tests (or parametrize cases) marked nodb get None and no database at all
+    """
+    if request.node.get_closest_marker("nodb"):
+        yield None
+        return
+
+    # Looked up lazily so nodb tests never set up the class transaction
+    connection = request.getfixturevalue("_class_connection")
+    savepoint = connection.begin_nested()
+    session = TestingSessionLocal(bind=connection, join_transaction_mode="create_savepoint")
+
+    # Tell FastAPI to use our test session instead of production
+    app.dependency_overrides[get_db] = lambda: session
+    cache_clear()
+
+    yield session
+
+    app.dependency_overrides.pop(get_db, None)
+    session.close()
+    savepoint.rollback()
+
+
+@pytest.fixture(scope="session")
+def client():
+    """
+    One test client for the whole session, so the app lifespan
+    (startup/shutdown) runs exactly once
+    """
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def created_url(client, db):
+    """
+    A basic shortened URL, created through the API
+    Returns a dict with its short_code and id
+    """
+    response = client.post("/api/urls/shorten", json={"long_url": "https://www.google.com"})
+    short_code = response.json()["short_code"]
+    # The shorten response has no id, read it from the test session instead of another GET
+    url_id = db.query(URL.id).filter(URL.short_code == short_code).scalar()
+    return {"short_code": short_code, "id": url_id}
+
+
+def _shorten_in_class(client, connection, body):
+    """
+    POST a URL into the class transaction, outside of any test's SAVEPOINT
+    """
+    session = TestingSessionLocal(bind=connection, join_transaction_mode="create_savepoint")
+    app.dependency_overrides[get_db] = lambda: session
+    try:
+        return client.post("/api/urls/shorten", json=body).json()
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+        session.close()
+
+
+@pytest.fixture(scope="class")
+def readonly_url(client, _class_connection):
+    """
+    A basic shortened URL created once per test class
+    Only for tests that read it, it stays in the class transaction
+    Returns its short_code
+    """
+    yield _shorten_in_class(client, _class_connection, {"long_url": "https://www.google.com"})["short_code"]
+
+
+@pytest.fixture(scope="class")
+def pw_url(client, _class_connection):
+    """
+    A URL protected by the password "mypassword", created once per test class
+    Returns its alias
+    """
+    body = {"long_url": "https://www.secret.com", "custom_alias": "secret", "password": "mypassword"}
+    _shorten_in_class(client, _class_connection, body)
+    yield body["custom_alias"]
+
+
+@pytest.fixture
+def url_row(db):
+    """
+    A basic URL inserted straight into the database, for tests
+    that don't exercise the shortening pipeline
+    """
+    url = URL(long_url="https://www.google.com/", short_code="abc123", is_active=True, click_count=0)
+    db.add(url)
+    db.commit()
+    return url
+
+
+@pytest.fixture
+def five_urls(db):
+    """
+    Five URLs (seed0..seed4) bulk-inserted in a single statement,
+    for the list and pagination tests
+    """
+    db.execute(insert(URL), [
+        {"long_url": f"https://www.example{i}.com/", "short_code": f"seed{i}", "is_active": True, "click_count": 0}
+        for i in range(5)
+    ])
+    db.commit()
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """
+    Swaps in an in-memory fake Redis for one test, so the lookup cache,
+    click buffering, password cache and redirect fast path all run
+    as they do with REDIS_URL set
+    """
+    fake = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+    monkeypatch.setattr(cache, "redis_client", fake)
+    yield fake
+
+
+@pytest.fixture
+def flush(db, fake_redis, monkeypatch):
+    """
+    tasks.flush_clicks.flush_clicks, writing through the test connection
+    instead of the production engine
+    """
+    connection = db.get_bind()
+    monkeypatch.setattr(
+        flush_clicks_task,
+        "SessionLocal",
+        lambda: TestingSessionLocal(bind=connection, join_transaction_mode="create_savepoint"),
+    )
+    return flush_clicks_task.flush_clicks
+
+
+@pytest.fixture
+def frozen_now():
+    """
+    Freezes the clock at 2025-01-01 00:00 UTC
+    Expiration tests move it with frozen_now.move_to(...) instead of sleeping
+    """
+    with time_machine.travel("2025-01-01T00:00:00Z", tick=False) as traveller:
+        yield traveller